@@ -2,24 +2,42 @@
 Interactive Book Q&A with LangChain + Ollama
 --------------------------------------------
 This script connects:
-1. A FAISS retriever (vector.py) for semantic search over book data.
+1. A FAISS retriever (vector.py) for semantic search over book data, plus a
+   batcher that serves concurrent callers with a single index search.
 2. An Ollama LLM for natural language reasoning.
-3. A simple chat loop for interactive Q&A.
+3. Exact lookups for author/decade counting questions.
+4. A semantic cache that reuses answers for repeated or paraphrased questions.
+5. A simple chat loop for interactive Q&A.
 
 Author: Chandrakant Kokje
 """
 
+import os
+import re
+import asyncio
+import faiss
+import numpy as np
 from langchain_ollama import OllamaLLM
 from langchain_core.prompts import ChatPromptTemplate
-from vector import retriever
+from vector import get_aggregates, get_embeddings, get_vector_store, search_by_vectors
 
 
 # -------------------------------------------------------------------
 # Step 1: Initialize the LLM
 # -------------------------------------------------------------------
-# Using Ollama with the llama3.2 model.
+# Using Ollama with the 4-bit (Q4_K_M) llama3.2 3B model: decoding is bound by
+# reading weights from memory, so the quantized weights roughly double tokens/s.
 # `num_thread` controls parallelism for faster inference on multi-core CPUs.
-model = OllamaLLM(model="llama3.2", num_thread=8)
+# `num_ctx` bounds the context window; `temperature=0` gives deterministic answers
+# that are safe to reuse from the semantic cache.
+# `keep_alive` keeps the model (and its prompt KV cache) loaded between turns.
+model = OllamaLLM(
+    model="llama3.2:3b-instruct-q4_K_M",
+    num_thread=os.cpu_count(),
+    num_ctx=4096,
+    temperature=0,
+    keep_alive="30m"
+)
 
 
 # -------------------------------------------------------------------
@@ -27,14 +45,15 @@ model = OllamaLLM(model="llama3.2", num_thread=8)
 # -------------------------------------------------------------------
 # The template combines retrieved context (reviews/metadata)
 # with the user’s question to guide the LLM’s response.
-template = """
-You are an expert at answering questions about books.
-
-Here are some relevant book entries:
-{reviews}
+# The static instruction comes first and the per-turn retrieved entries last,
+# so Ollama can reuse the KV cache for the shared prompt prefix.
+template = """You are an expert at answering questions about books.
 
 Here is the user’s question:
 {question}
+
+Here are some relevant book entries:
+{reviews}
 """
 prompt = ChatPromptTemplate.from_template(template=template)
 
@@ -48,26 +67,292 @@ chain = prompt | model
 
 
 # -------------------------------------------------------------------
-# Step 4: Interactive Chat Loop
+# Step 4: Counting Questions
 # -------------------------------------------------------------------
-# Continuously prompt the user for questions until they quit.
-# Each question is enriched with retrieved book data before being answered.
-print("📚 Book Q&A Assistant (type 'q' to quit)")
-print("-----------------------------------------")
+# Author and decade counts are exact facts, so they are answered from the
+# aggregate lookups in vector.py instead of going through retrieval + the LLM.
+# The lookups (and books.jsonl behind them) are only loaded once a question
+# actually matches one of the patterns below.
+author_counts_by_name = None
+
+
+def get_author_counts_by_name() -> dict:
+    """Map lower-cased author names to (author, count), built on first use."""
+    global author_counts_by_name
+    if author_counts_by_name is None:
+        author_counts, _ = get_aggregates()
+        author_counts_by_name = {author.lower(): (author, count) for author, count in author_counts.items()}
+    return author_counts_by_name
+
+
+# Each pattern must match the whole question; anything extra (a decade, a
+# rating, another author, ...) means the lookup cannot answer it, so it falls
+# through to RAG.
+AUTHOR_COUNT_PATTERN = re.compile(
+    r"^how many books (?:(?:does|did|has) (.+?) (?:have|write|written|published)"
+    r"|(?:are |were )?(?:written )?by (.+?))[?.]?$",
+    re.IGNORECASE
+)
+DECADE_COUNT_PATTERN = re.compile(
+    r"^how many books were (?:published|written|released) in the (\d{3})0'?s[?.]?$",
+    re.IGNORECASE
+)
+DECADE_MENTION_PATTERN = re.compile(r"\b\d{3}0'?s\b")
+TOP_AUTHOR_PATTERN = re.compile(
+    r"^which author has (?:written |published )?the most books[?.]?$", re.IGNORECASE
+)
+TOP_DECADE_PATTERN = re.compile(
+    r"^which decade had the most books(?: published)?[?.]?$", re.IGNORECASE
+)
+COMPARE_AUTHORS_PATTERN = re.compile(
+    r"^compare the number of books by (.+?) and (.+?)[?.]?$", re.IGNORECASE
+)
+DECADE_TRENDS_PATTERN = re.compile(
+    r"^summari[sz]e (?:book )?publishing trends (?:across|by|over) decades[?.]?$", re.IGNORECASE
+)
+
+
+def answer_count_question(question: str):
+    """
+    Answer author/decade counting questions from the aggregate lookups.
+
+    Args:
+        question (str): The user's question.
+
+    Returns:
+        str | None: The answer, or None if the question should go through RAG.
+    """
+    question = question.strip()
+
+    if match := DECADE_COUNT_PATTERN.match(question):
+        decade = int(match.group(1) + "0")
+        _, decade_counts = get_aggregates()
+        return f"In the {decade}s, {decade_counts.get(decade, 0)} books were published."
+
+    if (match := AUTHOR_COUNT_PATTERN.match(question)) and not DECADE_MENTION_PATTERN.search(question):
+        found = get_author_counts_by_name().get((match.group(1) or match.group(2)).strip().lower())
+        if found:
+            author, count = found
+            return f"Author {author} has {count} books in the dataset."
+        return None
+
+    if match := COMPARE_AUTHORS_PATTERN.match(question):
+        found = [get_author_counts_by_name().get(name.strip().lower()) for name in match.groups()]
+        if all(found):
+            (first, first_count), (second, second_count) = found
+            return (
+                f"Author {first} has {first_count} books and author {second} has "
+                f"{second_count} books in the dataset."
+            )
+        return None
+
+    if TOP_AUTHOR_PATTERN.match(question):
+        author_counts, _ = get_aggregates()
+        if not author_counts:
+            return None
+        author, count = max(author_counts.items(), key=lambda item: item[1])
+        return f"Author {author} has the most books in the dataset ({count})."
+
+    if TOP_DECADE_PATTERN.match(question):
+        _, decade_counts = get_aggregates()
+        if not decade_counts:
+            return None
+        decade, count = max(decade_counts.items(), key=lambda item: item[1])
+        return f"The {decade}s had the most books published ({count})."
+
+    if DECADE_TRENDS_PATTERN.match(question):
+        _, decade_counts = get_aggregates()
+        if not decade_counts:
+            return None
+        peak_decade, peak_count = max(decade_counts.items(), key=lambda item: item[1])
+        per_decade = ", ".join(f"{decade}s: {count}" for decade, count in sorted(decade_counts.items()))
+        return (
+            f"Books published per decade: {per_decade}. "
+            f"The busiest decade was the {peak_decade}s with {peak_count} books."
+        )
+
+    return None
+
+
+# -------------------------------------------------------------------
+# Step 5: Semantic Answer Cache
+# -------------------------------------------------------------------
+# LLM generation is the most expensive step, so answers are cached by the
+# embedding of the question. A paraphrase of an earlier question whose cosine
+# similarity clears the threshold reuses the stored answer.
+class SemanticCache:
+    """
+    Small in-memory cache mapping question embeddings to previously generated answers.
+
+    Once full, the oldest entry is evicted for each new one.
+
+    Args:
+        threshold (float): Minimum cosine similarity for a cache hit (default: 0.95).
+        max_entries (int): Maximum number of cached answers (default: 256).
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 256):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.index = None
+        self.entries = []
+
+    def lookup(self, question_embedding: np.ndarray):
+        """Return the cached answer closest to the question, or None on a miss."""
+        if self.index is None or self.index.ntotal == 0:
+            return None
+        scores, positions = self.index.search(question_embedding.reshape(1, -1), 1)
+        if scores[0][0] >= self.threshold:
+            return self.entries[positions[0][0]][1]
+        return None
+
+    def insert(self, question: str, question_embedding: np.ndarray, answer: str) -> None:
+        """Store an answer under the embedding of its question, evicting the oldest if full."""
+        if self.index is None:
+            self.index = faiss.IndexFlatIP(question_embedding.shape[0])
+        if len(self.entries) >= self.max_entries:
+            # IndexFlat compacts on removal, so positions stay aligned with `entries`
+            self.index.remove_ids(np.array([0], dtype="int64"))
+            self.entries.pop(0)
+        self.index.add(question_embedding.reshape(1, -1))
+        self.entries.append((question, answer))
 
-while True:
-    question = input("\nAsk your question: ")
-    if question.lower().strip() == "q":
-        print("👋 Exiting Book Q&A. Goodbye!")
-        break
+
+def embed_question(question: str) -> np.ndarray:
+    """Embed a question; the encoder already returns unit vectors, so inner product equals cosine."""
+    return np.asarray(get_embeddings().embed_query(question), dtype="float32")
+
+
+cache = SemanticCache(threshold=0.95, max_entries=256)
+
+
+# -------------------------------------------------------------------
+# Step 6: Batched Retrieval
+# -------------------------------------------------------------------
+# A single FAISS search over one question leaves most cores idle. Questions
+# arriving within a short window are queued and served by one batched search.
+# This is for concurrent (e.g. server) front ends; the interactive CLI below has
+# a single caller, so it searches directly instead.
+class RetrievalBatcher:
+    """
+    Single-consumer queue that groups retrieval requests into one FAISS search.
+
+    Args:
+        max_batch_size (int): Maximum questions per FAISS search (default: 32).
+        max_wait (float): Seconds to wait for more questions after the first (default: 0.01).
+    """
+
+    def __init__(self, max_batch_size: int = 32, max_wait: float = 0.01):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+
+    async def search(self, question_embedding: np.ndarray) -> list:
+        """Queue a question embedding and wait for its retrieved documents."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((question_embedding, future))
+        return await future
+
+    async def run(self) -> None:
+        """Drain queued questions in batches and fan the results back out."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+
+            # Take whatever is already queued, then optionally wait briefly for more
+            while len(batch) < self.max_batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            deadline = loop.time() + self.max_wait
+            while self.max_wait > 0 and len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            question_embeddings = np.stack([question_embedding for question_embedding, _ in batch])
+            try:
+                results = await asyncio.to_thread(search_by_vectors, question_embeddings)
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            for (_, future), reviews in zip(batch, results):
+                if not future.done():
+                    future.set_result(reviews)
+
+
+def stream_answer(question: str):
+    """
+    Answer a question via count lookup, the semantic cache, or retrieval + the LLM.
+
+    LLM output is yielded token by token as it is generated, so the answer
+    starts appearing after the first token instead of the full response.
+
+    Args:
+        question (str): The user's question.
+
+    Yields:
+        str: Chunks of the answer text.
+    """
+    # Counting questions are answered exactly, without retrieval or the LLM
+    result = answer_count_question(question)
+    if result is not None:
+        yield result
+        return
+
+    # Reuse a cached answer when the question matches an earlier one
+    question_embedding = embed_question(question)
+    result = cache.lookup(question_embedding)
+    if result is not None:
+        yield result
+        return
 
     # Retrieve relevant book documents from FAISS vector store
-    reviews = retriever.invoke(question)
+    reviews = search_by_vectors(question_embedding[None, :])[0]
 
     # Run the chain: inject retrieved docs + user question into the LLM
-    result = chain.invoke({"reviews": reviews, "question": question})
+    chunks = []
+    for chunk in chain.stream({"reviews": reviews, "question": question}):
+        chunks.append(chunk)
+        yield chunk
+    cache.insert(question, question_embedding, "".join(chunks))
+
+
+# -------------------------------------------------------------------
+# Step 7: Interactive Chat Loop
+# -------------------------------------------------------------------
+# Continuously prompt the user for questions until they quit.
+# Each question is enriched with retrieved book data before being answered.
+def chat_loop() -> None:
+    # Load (or build) the vector store before the first question, not mid-answer
+    get_vector_store()
+
+    print("📚 Book Q&A Assistant (type 'q' to quit)")
+    print("-----------------------------------------")
+
+    while True:
+        try:
+            question = input("\nAsk your question: ")
+        except (KeyboardInterrupt, EOFError):
+            question = "q"
+            print()
+        if question.lower().strip() == "q":
+            print("👋 Exiting Book Q&A. Goodbye!")
+            break
+
+        # Display the answer as it is generated
+        print("\n🔎 Answer:")
+        for chunk in stream_answer(question):
+            print(chunk, end="", flush=True)
+        print()
+        print("--------------------------------------------------")
+
 
-    # Display the answer
-    print("\n🔎 Answer:")
-    print(result)
-    print("--------------------------------------------------")
+if __name__ == "__main__":
+    chat_loop()